@@ -0,0 +1,131 @@
+"""Signed quick-action tokens and the replay cache behind them."""
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from config import Config
+from database import get_db
+
+# token -> (expires_at, status_code, mimetype, body), most recently used last
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+
+def _signature(action: str, task_id: int, value: Optional[str], nonce: str) -> str:
+    """Sign an action, its target task and its parameter value."""
+    message = f'{action}:{task_id}:{value or ""}:{nonce}'.encode()
+    return hmac.new(Config.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:24]
+
+
+def make_action_token(action: str, task_id: int, value: Optional[str] = None) -> str:
+    """Create a signed token that doubles as the link's idempotency key."""
+    nonce = secrets.token_urlsafe(9)
+    return f'{nonce}.{_signature(action, task_id, value, nonce)}'
+
+
+def verify_action_token(token: str, action: str, task_id: int,
+                        value: Optional[str] = None) -> bool:
+    """Check that a token was issued for exactly this action and value."""
+    nonce, _, signature = token.partition('.')
+    if not nonce or not signature:
+        return False
+    return hmac.compare_digest(signature, _signature(action, task_id, value, nonce))
+
+
+def get_action_result(token: str) -> Optional[Tuple[int, str, bytes]]:
+    """Return the cached (status_code, mimetype, body) for a token, if fresh."""
+    now = time.time()
+    with _results_lock:
+        cached = _results.get(token)
+        if cached:
+            expires_at, status_code, mimetype, body = cached
+            if expires_at > now:
+                _results.move_to_end(token)
+                return status_code, mimetype, body
+            del _results[token]
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''SELECT status_code, mimetype, body, created_at FROM action_results
+               WHERE token = ? AND status_code IS NOT NULL AND created_at >= ?''',
+            (token, _cutoff())
+        )
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    expires_at = (datetime.fromisoformat(row['created_at']).timestamp()
+                  + Config.ACTION_DEDUPE_SECONDS)
+    _remember(token, expires_at, row['status_code'], row['mimetype'], row['body'])
+    return row['status_code'], row['mimetype'], row['body']
+
+
+def reserve_action(token: str) -> bool:
+    """Claim a token before running its action.
+
+    Returns False if another request already claimed it, in which case the
+    caller must not apply the action again. A reservation without a result
+    (created_at is when it was claimed) is only held for ACTION_LEASE_SECONDS,
+    so one left behind by a killed process does not block the link.
+    """
+    lease_cutoff = datetime.now() - timedelta(seconds=Config.ACTION_LEASE_SECONDS)
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM action_results WHERE created_at < ?', (_cutoff(),))
+        cursor.execute(
+            '''DELETE FROM action_results
+               WHERE token = ? AND status_code IS NULL AND created_at < ?''',
+            (token, lease_cutoff.isoformat())
+        )
+        cursor.execute(
+            'INSERT OR IGNORE INTO action_results (token, created_at) VALUES (?, ?)',
+            (token, datetime.now().isoformat())
+        )
+        reserved = cursor.rowcount > 0
+        conn.commit()
+    return reserved
+
+
+def release_action(token: str):
+    """Drop a reservation whose action failed, so the link can be retried."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'DELETE FROM action_results WHERE token = ? AND status_code IS NULL',
+            (token,)
+        )
+        conn.commit()
+
+
+def store_action_result(token: str, status_code: int, mimetype: str, body: bytes):
+    """Record the response of a reserved action in memory and in the database."""
+    _remember(token, time.time() + Config.ACTION_DEDUPE_SECONDS, status_code, mimetype, body)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''UPDATE action_results SET status_code = ?, mimetype = ?, body = ?
+               WHERE token = ?''',
+            (status_code, mimetype, body, token)
+        )
+        conn.commit()
+
+
+def _cutoff() -> str:
+    """Oldest created_at that is still inside the dedupe window."""
+    return (datetime.now() - timedelta(seconds=Config.ACTION_DEDUPE_SECONDS)).isoformat()
+
+
+def _remember(token: str, expires_at: float, status_code: int, mimetype: str, body: bytes):
+    """Add a result to the in-memory cache, evicting the least recently used."""
+    with _results_lock:
+        _results[token] = (expires_at, status_code, mimetype, body)
+        _results.move_to_end(token)
+        while len(_results) > Config.ACTION_CACHE_SIZE:
+            _results.popitem(last=False)
@@ -1,17 +1,54 @@
 """Main Flask application for WhatsApp Task Manager."""
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import (Blueprint, Flask, current_app, request, jsonify, render_template,
+                   redirect, url_for, make_response)
 from datetime import datetime
-from dateutil import parser as date_parser
+from functools import wraps
+from urllib.parse import urlencode
 import re
-from database import init_db
+import threading
+import time
+from typing import Optional
+from actions import (make_action_token, verify_action_token, get_action_result,
+                     reserve_action, release_action, store_action_result)
 from models import Task
 from config import Config
 
-app = Flask(__name__)
-app.config.from_object(Config)
+bp = Blueprint('tasks', __name__)
 
-# Initialize database on startup
-init_db()
+# Largest ID SQLite can store in an INTEGER PRIMARY KEY
+MAX_TASK_ID = 2 ** 63 - 1
+
+
+def create_app() -> Flask:
+    """Create the Flask application.
+
+    Nothing slow happens here: the database schema is checked on first use
+    (see database.get_db) and templates are compiled in the background once
+    the first response has been sent.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.register_blueprint(bp)
+
+    if Config.PRELOAD_TEMPLATES:
+        preload_started = threading.Event()
+
+        @app.after_request
+        def start_template_preload(response):
+            if not preload_started.is_set():
+                preload_started.set()
+                response.call_on_close(lambda: threading.Thread(
+                    target=preload_templates, args=(app,), daemon=True
+                ).start())
+            return response
+
+    return app
+
+
+def preload_templates(app: Flask):
+    """Compile every template into the Jinja cache."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
 
 
 def parse_whatsapp_task(text: str) -> dict:
@@ -23,6 +60,12 @@ def parse_whatsapp_task(text: str) -> dict:
     Owner: Wife
     Due: Thu 20:00
     Next: Ofek submits
+
+    Multi-step workflows add ordered Step lines (a leading user name makes
+    that user the step owner) and After lines listing task IDs to wait for:
+    Step: Wife uploads docs
+    Step: Ofek submits to portal
+    After: #12, #13
     """
     lines = text.strip().split('\n')
     task_data = {}
@@ -46,10 +89,52 @@ def parse_whatsapp_task(text: str) -> dict:
                 task_data['due_date'] = parse_due_date(value)
             elif key == 'next':
                 task_data['next_step'] = value
+            elif key == 'step':
+                task_data.setdefault('steps', []).append(value)
+            elif key == 'after':
+                task_data.setdefault('depends_on', []).extend(
+                    int(task_id) for task_id in re.findall(r'\d+', value)
+                )
 
     return task_data
 
 
+def validate_task_json(data: dict) -> Optional[str]:
+    """Check the field types of a task creation request.
+
+    Returns an error message, or None if the request is valid.
+    """
+    for field in ('title', 'owner'):
+        if not isinstance(data[field], str) or not data[field].strip():
+            return f'"{field}" must be a non-empty string'
+
+    for field in ('due_date', 'next_step', 'notes'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return f'"{field}" must be a string'
+
+    steps = data.get('steps')
+    if steps is not None and not (
+        isinstance(steps, list)
+        and all(isinstance(step, str)
+                or (isinstance(step, dict)
+                    and isinstance(step.get('description'), str)
+                    and (step.get('owner') is None or isinstance(step['owner'], str)))
+                for step in steps)
+    ):
+        return '"steps" must be a list of strings or {"description", "owner"} objects'
+
+    depends_on = data.get('depends_on')
+    if depends_on is not None and not (
+        isinstance(depends_on, list)
+        and all(isinstance(dep_id, int) and not isinstance(dep_id, bool)
+                and 0 < dep_id <= MAX_TASK_ID
+                for dep_id in depends_on)
+    ):
+        return '"depends_on" must be a list of task IDs'
+
+    return None
+
+
 def parse_due_date(due_str: str) -> str:
     """Parse a due date string into ISO format.
 
@@ -58,6 +143,9 @@ def parse_due_date(due_str: str) -> str:
     - 2024-01-15 20:00
     - Jan 15 8pm
     """
+    # Imported lazily: dateutil is slow to import and only needed here
+    from dateutil import parser as date_parser
+
     try:
         # Try parsing as full datetime
         dt = date_parser.parse(due_str, fuzzy=True)
@@ -67,50 +155,126 @@ def parse_due_date(due_str: str) -> str:
         return due_str
 
 
+def action_url(action: str, task_id: int, param: str = None, value: str = None) -> str:
+    """Build a signed quick action URL; its token is the idempotency key."""
+    query = {param: value} if param else {}
+    query['token'] = make_action_token(action, task_id, value)
+    return f'{Config.BASE_URL}/{action}/{task_id}?{urlencode(query)}'
+
+
 def generate_quick_actions(task_id: int) -> dict:
-    """Generate quick action URLs for a task."""
-    base = Config.BASE_URL
+    """Generate quick action URLs for a task.
+
+    Mutating links carry a signed token, so repeated taps and link-preview
+    crawlers get the first response back instead of applying the action again.
+    For a task with steps, the mark-done link names the active step, so it
+    can only ever finish that step.
+    """
+    active_step = Task.get_active_step(task_id)
+    if active_step:
+        mark_done = action_url('markDone', task_id, 'step', str(active_step['position']))
+    else:
+        mark_done = action_url('markDone', task_id)
+
     return {
-        'mark_done': f'{base}/markDone/{task_id}',
-        'reassign_ofek': f'{base}/reassign/{task_id}?to=Ofek',
-        'reassign_wife': f'{base}/reassign/{task_id}?to=Wife',
-        'view_task': f'{base}/task/{task_id}',
+        'mark_done': mark_done,
+        'reassign_ofek': action_url('reassign', task_id, 'to', 'Ofek'),
+        'reassign_wife': action_url('reassign', task_id, 'to', 'Wife'),
+        'view_task': f'{Config.BASE_URL}/task/{task_id}',
     }
 
 
+def idempotent_action(action: str, param: str = None):
+    """Apply a signed quick action link at most once.
+
+    The token is reserved before the view runs, so concurrent hits (a
+    link-preview crawler and a tap) cannot both reach the write path; later
+    hits get the stored response back. Requests without a token are handled
+    as before; the model updates are conditional, so they are no-ops when
+    nothing changes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(task_id):
+            token = request.args.get('token') or request.form.get('token')
+            if not token:
+                return view(task_id)
+
+            value = (request.args.get(param) or request.form.get(param)) if param else None
+            if not verify_action_token(token, action, task_id, value):
+                return jsonify({'error': 'Invalid action token'}), 403
+
+            cached = get_action_result(token)
+            if cached:
+                return current_app.response_class(cached[2], status=cached[0], mimetype=cached[1])
+
+            if not reserve_action(token):
+                # Another request holds the token; wait briefly for its result
+                deadline = time.monotonic() + 2
+                while time.monotonic() < deadline:
+                    cached = get_action_result(token)
+                    if cached:
+                        return current_app.response_class(cached[2], status=cached[0],
+                                                          mimetype=cached[1])
+                    time.sleep(0.05)
+                return jsonify({'error': 'Action already in progress'}), 409
+
+            try:
+                response = make_response(view(task_id))
+            except Exception:
+                release_action(token)
+                raise
+
+            if response.status_code < 400:
+                store_action_result(token, response.status_code, response.mimetype,
+                                    response.get_data())
+            else:
+                release_action(token)
+            return response
+        return wrapper
+    return decorator
+
+
 # ============================================================================
 # Web UI Routes
 # ============================================================================
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Home page - redirect to open tasks."""
-    return redirect(url_for('open_tasks'))
+    return redirect(url_for('tasks.open_tasks'))
 
 
-@app.route('/open')
+@bp.route('/open')
 def open_tasks():
     """View all open tasks."""
     tasks = Task.get_all_open()
-    return render_template('open.html', tasks=tasks, base_url=Config.BASE_URL)
+    active_steps = Task.get_active_step_positions([task.id for task in tasks])
+    return render_template('open.html', tasks=tasks, active_steps=active_steps,
+                         base_url=Config.BASE_URL)
 
 
-@app.route('/mine')
+@bp.route('/mine')
 def my_tasks():
     """View tasks for a specific owner."""
     owner = request.args.get('owner', 'Ofek')
-    tasks = Task.get_by_owner(owner)
-    return render_template('mine.html', tasks=tasks, owner=owner, base_url=Config.BASE_URL)
+    tasks = Task.get_ready_by_owner(owner)
+    blocked_tasks = Task.get_blocked_by_owner(owner)
+    active_steps = Task.get_active_step_positions([task.id for task in tasks])
+    return render_template('mine.html', tasks=tasks, blocked_tasks=blocked_tasks,
+                         active_steps=active_steps, owner=owner, base_url=Config.BASE_URL)
 
 
-@app.route('/today')
+@bp.route('/today')
 def today_tasks():
     """View tasks due today."""
     tasks = Task.get_today()
-    return render_template('today.html', tasks=tasks, base_url=Config.BASE_URL)
+    active_steps = Task.get_active_step_positions([task.id for task in tasks])
+    return render_template('today.html', tasks=tasks, active_steps=active_steps,
+                         base_url=Config.BASE_URL)
 
 
-@app.route('/task/<int:task_id>')
+@bp.route('/task/<int:task_id>')
 def view_task(task_id):
     """View a single task with quick actions."""
     task = Task.get_by_id(task_id)
@@ -118,14 +282,17 @@ def view_task(task_id):
         return jsonify({'error': 'Task not found'}), 404
 
     actions = generate_quick_actions(task_id)
-    return render_template('task.html', task=task, actions=actions, base_url=Config.BASE_URL)
+    steps = Task.get_steps(task_id)
+    dependencies = Task.get_dependencies(task_id)
+    return render_template('task.html', task=task, actions=actions, steps=steps,
+                         dependencies=dependencies, base_url=Config.BASE_URL)
 
 
 # ============================================================================
 # API Routes - Task Management
 # ============================================================================
 
-@app.route('/api/newTask', methods=['POST'])
+@bp.route('/api/newTask', methods=['POST'])
 def create_task_api():
     """Create a new task via API.
 
@@ -135,21 +302,32 @@ def create_task_api():
         "owner": "Owner name",
         "due_date": "2024-01-15 20:00",  // optional
         "next_step": "Next step",         // optional
-        "notes": "Additional notes"       // optional
+        "notes": "Additional notes",      // optional
+        "steps": ["Step 1", {"description": "Step 2", "owner": "Wife"}],  // optional
+        "depends_on": [12, 13]            // optional
     }
     """
     data = request.get_json()
 
-    if not data or 'title' not in data or 'owner' not in data:
+    if not isinstance(data, dict) or 'title' not in data or 'owner' not in data:
         return jsonify({'error': 'Missing required fields: title, owner'}), 400
 
-    task_id = Task.create(
-        title=data['title'],
-        owner=data['owner'],
-        due_date=data.get('due_date'),
-        next_step=data.get('next_step'),
-        notes=data.get('notes')
-    )
+    error = validate_task_json(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        task_id = Task.create(
+            title=data['title'],
+            owner=data['owner'],
+            due_date=data.get('due_date'),
+            next_step=data.get('next_step'),
+            notes=data.get('notes'),
+            steps=data.get('steps'),
+            depends_on=data.get('depends_on')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     actions = generate_quick_actions(task_id)
 
@@ -161,7 +339,7 @@ def create_task_api():
     }), 201
 
 
-@app.route('/newTask', methods=['GET', 'POST'])
+@bp.route('/newTask', methods=['GET', 'POST'])
 def create_task():
     """Create a new task from WhatsApp format or form.
 
@@ -179,7 +357,10 @@ def create_task():
         if not task_data.get('title') or not task_data.get('owner'):
             return jsonify({'error': 'Could not parse task. Missing title or owner.'}), 400
 
-        task_id = Task.create(**task_data)
+        try:
+            task_id = Task.create(**task_data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         actions = generate_quick_actions(task_id)
 
         return render_template('task_created.html',
@@ -197,26 +378,43 @@ def create_task():
         notes=request.form.get('notes')
     )
 
-    return redirect(url_for('view_task', task_id=task_id))
+    return redirect(url_for('tasks.view_task', task_id=task_id))
 
 
-@app.route('/markDone/<int:task_id>', methods=['GET', 'POST'])
+@bp.route('/markDone/<int:task_id>', methods=['GET', 'POST'])
+@idempotent_action('markDone', 'step')
 def mark_done(task_id):
-    """Mark a task as done."""
-    success = Task.mark_done(task_id)
+    """Mark a task (or its active workflow step) as done.
+
+    An optional step parameter names the step to finish; if it is no longer
+    active, nothing changes.
+    """
+    step = request.args.get('step') or request.form.get('step')
+    if step is not None and not step.isdigit():
+        return jsonify({'error': 'Invalid "step" parameter'}), 400
+
+    success = Task.mark_done(task_id, expected_step=int(step) if step else None)
 
     if not success:
         return jsonify({'error': 'Task not found'}), 404
 
+    # A task that is still open was handed over to its next step
+    task = Task.get_by_id(task_id)
+    if task.status == 'open':
+        message = f'Task #{task_id} step done — next: {task.next_step} ({task.owner})'
+    else:
+        message = f'Task #{task_id} marked as done'
+
     if request.method == 'GET':
         return render_template('action_success.html',
-                             message=f'Task #{task_id} marked as done!',
-                             redirect_url=url_for('open_tasks'))
+                             message=f'{message}!',
+                             redirect_url=url_for('tasks.open_tasks'))
 
-    return jsonify({'success': True, 'message': f'Task #{task_id} marked as done'})
+    return jsonify({'success': True, 'message': message})
 
 
-@app.route('/reassign/<int:task_id>', methods=['GET', 'POST'])
+@bp.route('/reassign/<int:task_id>', methods=['GET', 'POST'])
+@idempotent_action('reassign', 'to')
 def reassign_task(task_id):
     """Reassign a task to a new owner."""
     new_owner = request.args.get('to') or request.form.get('to')
@@ -232,12 +430,12 @@ def reassign_task(task_id):
     if request.method == 'GET':
         return render_template('action_success.html',
                              message=f'Task #{task_id} reassigned to {new_owner}!',
-                             redirect_url=url_for('open_tasks'))
+                             redirect_url=url_for('tasks.open_tasks'))
 
     return jsonify({'success': True, 'message': f'Task reassigned to {new_owner}'})
 
 
-@app.route('/updateDue/<int:task_id>', methods=['GET', 'POST'])
+@bp.route('/updateDue/<int:task_id>', methods=['GET', 'POST'])
 def update_due_date(task_id):
     """Update the due date of a task."""
     new_due = request.args.get('date') or request.form.get('date')
@@ -256,12 +454,12 @@ def update_due_date(task_id):
     if request.method == 'GET':
         return render_template('action_success.html',
                              message=f'Task #{task_id} due date updated!',
-                             redirect_url=url_for('view_task', task_id=task_id))
+                             redirect_url=url_for('tasks.view_task', task_id=task_id))
 
     return jsonify({'success': True, 'message': f'Due date updated'})
 
 
-@app.route('/updateNext/<int:task_id>', methods=['GET', 'POST'])
+@bp.route('/updateNext/<int:task_id>', methods=['GET', 'POST'])
 def update_next_step(task_id):
     """Update the next step of a task."""
     next_step = request.args.get('step') or request.form.get('step')
@@ -277,22 +475,49 @@ def update_next_step(task_id):
     if request.method == 'GET':
         return render_template('action_success.html',
                              message=f'Task #{task_id} next step updated!',
-                             redirect_url=url_for('view_task', task_id=task_id))
+                             redirect_url=url_for('tasks.view_task', task_id=task_id))
 
     return jsonify({'success': True, 'message': f'Next step updated'})
 
 
+@bp.route('/addDependency/<int:task_id>', methods=['GET', 'POST'])
+def add_dependency(task_id):
+    """Make a task wait for another task to be done."""
+    depends_on_id = request.args.get('on') or request.form.get('on')
+
+    if not depends_on_id or not depends_on_id.isdigit():
+        return jsonify({'error': 'Missing or invalid "on" parameter'}), 400
+
+    try:
+        success = Task.add_dependency(task_id, int(depends_on_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not success:
+        return jsonify({'error': 'Task not found'}), 404
+
+    if request.method == 'GET':
+        return render_template('action_success.html',
+                             message=f'Task #{task_id} now waits for task #{depends_on_id}!',
+                             redirect_url=url_for('tasks.view_task', task_id=task_id))
+
+    return jsonify({'success': True, 'message': f'Dependency added'})
+
+
 # ============================================================================
 # API Routes - Data Access
 # ============================================================================
 
-@app.route('/api/tasks', methods=['GET'])
+@bp.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    """Get all tasks or filter by status/owner."""
+    """Get all tasks or filter by status/owner (add ready=1 for actionable ones)."""
     status = request.args.get('status')
     owner = request.args.get('owner')
+    ready = request.args.get('ready')
 
-    if owner:
+    if owner and ready:
+        tasks = Task.get_ready_by_owner(owner)
+    elif owner:
         tasks = Task.get_by_owner(owner)
     elif status == 'open':
         tasks = Task.get_all_open()
@@ -304,7 +529,7 @@ def get_tasks():
     })
 
 
-@app.route('/api/task/<int:task_id>', methods=['GET'])
+@bp.route('/api/task/<int:task_id>', methods=['GET'])
 def get_task(task_id):
     """Get a specific task."""
     task = Task.get_by_id(task_id)
@@ -312,18 +537,21 @@ def get_task(task_id):
     if not task:
         return jsonify({'error': 'Task not found'}), 404
 
-    return jsonify(task.to_dict())
+    data = task.to_dict()
+    data['steps'] = Task.get_steps(task_id)
+    data['depends_on'] = [dep.id for dep in Task.get_dependencies(task_id)]
+    return jsonify(data)
 
 
 # ============================================================================
 # Health Check
 # ============================================================================
 
-@app.route('/health')
+@bp.route('/health')
 def health():
     """Health check endpoint."""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=Config.DEBUG)
+    create_app().run(host='0.0.0.0', port=5000, debug=Config.DEBUG)
@@ -10,9 +10,18 @@ class Config:
     # Flask
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+    # Compile templates in the background after the first response
+    PRELOAD_TEMPLATES = os.getenv('PRELOAD_TEMPLATES', 'True').lower() == 'true'
 
     # Application
     BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
 
+    # Quick actions: replays of the same signed link within this window are
+    # answered from cache instead of being applied again
+    ACTION_DEDUPE_SECONDS = int(os.getenv('ACTION_DEDUPE_SECONDS', '3600'))
+    ACTION_CACHE_SIZE = 1024
+    # A reservation left behind by a request that died is taken over after this
+    ACTION_LEASE_SECONDS = int(os.getenv('ACTION_LEASE_SECONDS', '10'))
+
     # Users (can be extended)
     USERS = ['Ofek', 'Wife']
@@ -1,14 +1,32 @@
 """Database setup and management."""
 import sqlite3
+import threading
 from contextlib import contextmanager
 from datetime import datetime
 from config import Config
 
+# Bump whenever init_db changes, so existing databases get the new DDL
+SCHEMA_VERSION = 1
+
+# Database paths whose schema has been checked by this process
+_initialized_paths = set()
+_init_lock = threading.Lock()
+
 def init_db():
-    """Initialize the database with required tables."""
+    """Initialize the database with required tables.
+
+    Databases already at SCHEMA_VERSION are left untouched, so this costs a
+    single PRAGMA read on a warm database.
+    """
     conn = sqlite3.connect(Config.DATABASE_PATH)
     cursor = conn.cursor()
 
+    cursor.execute('PRAGMA user_version')
+    if cursor.fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        _initialized_paths.add(Config.DATABASE_PATH)
+        return
+
     # Tasks table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS tasks (
@@ -36,12 +54,93 @@ def init_db():
         )
     ''')
 
+    # Ordered workflow steps; at most one step per task is 'active'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_steps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            completed_at TEXT,
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            UNIQUE (task_id, position)
+        )
+    ''')
+
+    # Dependency edges between tasks: task_id waits for depends_on_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_dependencies (
+            task_id INTEGER NOT NULL,
+            depends_on_id INTEGER NOT NULL,
+            PRIMARY KEY (task_id, depends_on_id),
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            FOREIGN KEY (depends_on_id) REFERENCES tasks (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_task_dependencies_depends_on
+        ON task_dependencies (depends_on_id)
+    ''')
+
+    # Readiness index: number of unfinished dependencies per task, kept up
+    # to date on every edge insert and completion so /mine never walks the graph
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_readiness (
+            task_id INTEGER PRIMARY KEY,
+            pending_deps INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_task_readiness_pending
+        ON task_readiness (pending_deps, task_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tasks_owner_status
+        ON tasks (owner, status)
+    ''')
+
+    # Responses of signed quick-action links, keyed by their token. A row
+    # with no status_code is a reservation for a request still in progress.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS action_results (
+            token TEXT PRIMARY KEY,
+            status_code INTEGER,
+            mimetype TEXT,
+            body BLOB,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_action_results_created_at
+        ON action_results (created_at)
+    ''')
+
+    # Tasks created before workflows existed have no dependencies
+    cursor.execute('''
+        INSERT OR IGNORE INTO task_readiness (task_id, pending_deps)
+        SELECT id, 0 FROM tasks
+    ''')
+
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
     conn.close()
+    _initialized_paths.add(Config.DATABASE_PATH)
+
+def ensure_db():
+    """Run init_db once per database path, on first use rather than at import."""
+    if Config.DATABASE_PATH in _initialized_paths:
+        return
+    with _init_lock:
+        if Config.DATABASE_PATH not in _initialized_paths:
+            init_db()
 
 @contextmanager
 def get_db():
     """Context manager for database connections."""
+    ensure_db()
     conn = sqlite3.connect(Config.DATABASE_PATH)
     conn.row_factory = sqlite3.Row  # Enable column access by name
     try:
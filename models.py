@@ -1,6 +1,7 @@
 """Task model and operations."""
 from datetime import datetime
 from typing import List, Optional, Dict
+from config import Config
 from database import get_db, add_task_history
 
 class Task:
@@ -18,20 +19,87 @@ class Task:
         self.completed_at = completed_at
         self.notes = notes
 
+    @staticmethod
+    def from_row(row) -> 'Task':
+        """Build a Task from a tasks table row."""
+        return Task(
+            id=row['id'],
+            title=row['title'],
+            owner=row['owner'],
+            due_date=row['due_date'],
+            next_step=row['next_step'],
+            status=row['status'],
+            created_at=row['created_at'],
+            completed_at=row['completed_at'],
+            notes=row['notes']
+        )
+
     @staticmethod
     def create(title: str, owner: str, due_date: Optional[str] = None,
-               next_step: Optional[str] = None, notes: Optional[str] = None) -> int:
-        """Create a new task and return its ID."""
+               next_step: Optional[str] = None, notes: Optional[str] = None,
+               steps: Optional[List] = None,
+               depends_on: Optional[List[int]] = None) -> int:
+        """Create a new task and return its ID.
+
+        steps is an ordered list of step descriptions (or dicts with
+        'description' and optional 'owner'). A step without an owner is owned
+        by the user its description starts with, else by the task owner. The
+        first step starts active and the task is owned by whoever owns the
+        active step.
+
+        depends_on lists task IDs that must be done before this task is ready.
+        Raises ValueError if any of them does not exist.
+        """
+        steps = _normalize_steps(steps, owner)
+        depends_on = sorted({int(dep_id) for dep_id in depends_on or []})
+
+        if steps:
+            owner = steps[0]['owner']
+            next_step = steps[0]['description']
+
         with get_db() as conn:
             cursor = conn.cursor()
+            # Hold the write lock while reading dependency statuses, so a
+            # concurrent mark_done cannot slip in before pending_deps is stored
+            cursor.execute('BEGIN IMMEDIATE')
+
+            pending_deps = 0
+            if depends_on:
+                placeholders = ', '.join('?' for _ in depends_on)
+                cursor.execute(
+                    f'SELECT id, status FROM tasks WHERE id IN ({placeholders})',
+                    depends_on
+                )
+                statuses = {row['id']: row['status'] for row in cursor.fetchall()}
+                missing = [dep_id for dep_id in depends_on if dep_id not in statuses]
+                if missing:
+                    raise ValueError(f'Task #{missing[0]} not found')
+                pending_deps = sum(1 for status in statuses.values() if status != 'done')
+
             cursor.execute(
                 '''INSERT INTO tasks (title, owner, due_date, next_step, status, created_at, notes)
                    VALUES (?, ?, ?, ?, 'open', ?, ?)''',
                 (title, owner, due_date, next_step, datetime.now().isoformat(), notes)
             )
-            conn.commit()
             task_id = cursor.lastrowid
 
+            cursor.executemany(
+                '''INSERT INTO task_steps (task_id, position, description, owner, status)
+                   VALUES (?, ?, ?, ?, ?)''',
+                [(task_id, position, step['description'], step['owner'],
+                  'active' if position == 0 else 'pending')
+                 for position, step in enumerate(steps)]
+            )
+            cursor.executemany(
+                'INSERT INTO task_dependencies (task_id, depends_on_id) VALUES (?, ?)',
+                [(task_id, dep_id) for dep_id in depends_on]
+            )
+            cursor.execute(
+                'INSERT INTO task_readiness (task_id, pending_deps) VALUES (?, ?)',
+                (task_id, pending_deps)
+            )
+            conn.commit()
+
             # Add to history
             add_task_history(task_id, 'created', f'Task created: {title}')
 
@@ -46,17 +114,7 @@ class Task:
             row = cursor.fetchone()
 
             if row:
-                return Task(
-                    id=row['id'],
-                    title=row['title'],
-                    owner=row['owner'],
-                    due_date=row['due_date'],
-                    next_step=row['next_step'],
-                    status=row['status'],
-                    created_at=row['created_at'],
-                    completed_at=row['completed_at'],
-                    notes=row['notes']
-                )
+                return Task.from_row(row)
             return None
 
     @staticmethod
@@ -67,17 +125,7 @@ class Task:
             cursor.execute('SELECT * FROM tasks WHERE status = "open" ORDER BY due_date, id')
             rows = cursor.fetchall()
 
-            return [Task(
-                id=row['id'],
-                title=row['title'],
-                owner=row['owner'],
-                due_date=row['due_date'],
-                next_step=row['next_step'],
-                status=row['status'],
-                created_at=row['created_at'],
-                completed_at=row['completed_at'],
-                notes=row['notes']
-            ) for row in rows]
+            return [Task.from_row(row) for row in rows]
 
     @staticmethod
     def get_by_owner(owner: str) -> List['Task']:
@@ -90,17 +138,7 @@ class Task:
             )
             rows = cursor.fetchall()
 
-            return [Task(
-                id=row['id'],
-                title=row['title'],
-                owner=row['owner'],
-                due_date=row['due_date'],
-                next_step=row['next_step'],
-                status=row['status'],
-                created_at=row['created_at'],
-                completed_at=row['completed_at'],
-                notes=row['notes']
-            ) for row in rows]
+            return [Task.from_row(row) for row in rows]
 
     @staticmethod
     def get_today() -> List['Task']:
@@ -116,81 +154,284 @@ class Task:
             )
             rows = cursor.fetchall()
 
-            return [Task(
-                id=row['id'],
-                title=row['title'],
-                owner=row['owner'],
-                due_date=row['due_date'],
-                next_step=row['next_step'],
-                status=row['status'],
-                created_at=row['created_at'],
-                completed_at=row['completed_at'],
-                notes=row['notes']
-            ) for row in rows]
+            return [Task.from_row(row) for row in rows]
+
+    @staticmethod
+    def get_ready_by_owner(owner: str) -> List['Task']:
+        """Get open tasks for an owner whose dependencies are all done."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT t.* FROM tasks t
+                   JOIN task_readiness r ON r.task_id = t.id
+                   WHERE t.owner = ? AND t.status = "open" AND r.pending_deps = 0
+                   ORDER BY t.due_date, t.id''',
+                (owner,)
+            )
+            rows = cursor.fetchall()
+
+            return [Task.from_row(row) for row in rows]
+
+    @staticmethod
+    def get_blocked_by_owner(owner: str) -> List['Task']:
+        """Get open tasks for an owner that are still waiting on other tasks."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT t.* FROM tasks t
+                   JOIN task_readiness r ON r.task_id = t.id
+                   WHERE t.owner = ? AND t.status = "open" AND r.pending_deps > 0
+                   ORDER BY t.due_date, t.id''',
+                (owner,)
+            )
+            rows = cursor.fetchall()
+
+            return [Task.from_row(row) for row in rows]
+
+    @staticmethod
+    def get_steps(task_id: int) -> List[Dict]:
+        """Get the workflow steps of a task in order."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT position, description, owner, status, completed_at
+                   FROM task_steps WHERE task_id = ? ORDER BY position''',
+                (task_id,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def get_dependencies(task_id: int) -> List['Task']:
+        """Get the tasks this task is waiting for."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT t.* FROM tasks t
+                   JOIN task_dependencies d ON d.depends_on_id = t.id
+                   WHERE d.task_id = ?
+                   ORDER BY t.id''',
+                (task_id,)
+            )
+            rows = cursor.fetchall()
+
+            return [Task.from_row(row) for row in rows]
 
     @staticmethod
-    def mark_done(task_id: int) -> bool:
-        """Mark a task as done."""
+    def add_dependency(task_id: int, depends_on_id: int) -> bool:
+        """Make a task wait for another task to be done.
+
+        Returns False if either task does not exist. Raises ValueError if the
+        new edge would create a cycle.
+        """
+        if task_id == depends_on_id:
+            raise ValueError('A task cannot depend on itself')
+
         with get_db() as conn:
             cursor = conn.cursor()
+            # Same write lock as in create: the status read and the counter
+            # update must not interleave with mark_done
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(
+                'SELECT id, status FROM tasks WHERE id IN (?, ?)',
+                (task_id, depends_on_id)
+            )
+            statuses = {row['id']: row['status'] for row in cursor.fetchall()}
+            if task_id not in statuses or depends_on_id not in statuses:
+                return False
+
+            # The edge closes a cycle iff task_id is already upstream of
+            # depends_on_id. UNION visits each task once, so this is linear in
+            # the reachable part of the graph.
+            cursor.execute(
+                '''WITH RECURSIVE upstream(id) AS (
+                       SELECT ?
+                       UNION
+                       SELECT d.depends_on_id FROM task_dependencies d
+                       JOIN upstream u ON d.task_id = u.id
+                   )
+                   SELECT 1 FROM upstream WHERE id = ? LIMIT 1''',
+                (depends_on_id, task_id)
+            )
+            if cursor.fetchone():
+                raise ValueError(
+                    f'Task #{depends_on_id} already depends on task #{task_id}'
+                )
+
             cursor.execute(
-                'UPDATE tasks SET status = "done", completed_at = ? WHERE id = ?',
-                (datetime.now().isoformat(), task_id)
+                'INSERT OR IGNORE INTO task_dependencies (task_id, depends_on_id) VALUES (?, ?)',
+                (task_id, depends_on_id)
             )
+            if cursor.rowcount == 0:
+                return True
+
+            if statuses[depends_on_id] != 'done':
+                cursor.execute(
+                    'UPDATE task_readiness SET pending_deps = pending_deps + 1 WHERE task_id = ?',
+                    (task_id,)
+                )
             conn.commit()
 
+            add_task_history(task_id, 'dependency_added', f'Waits for task #{depends_on_id}')
+            return True
+
+    @staticmethod
+    def get_active_step(task_id: int) -> Optional[Dict]:
+        """Get the active workflow step of a task, if it has one."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''SELECT position, description, owner FROM task_steps
+                   WHERE task_id = ? AND status = "active"''',
+                (task_id,)
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_active_step_positions(task_ids: List[int]) -> Dict[int, int]:
+        """Map task ID to the position of its active step, for tasks with steps."""
+        if not task_ids:
+            return {}
+        with get_db() as conn:
+            cursor = conn.cursor()
+            placeholders = ', '.join('?' for _ in task_ids)
+            cursor.execute(
+                f'''SELECT task_id, position FROM task_steps
+                    WHERE status = "active" AND task_id IN ({placeholders})''',
+                task_ids
+            )
+            return {row['task_id']: row['position'] for row in cursor.fetchall()}
+
+    @staticmethod
+    def mark_done(task_id: int, expected_step: Optional[int] = None) -> bool:
+        """Mark a task (or its active workflow step) as done.
+
+        If the task has a pending step, that step is activated and the task is
+        reassigned to its owner instead. When the task itself is completed,
+        every task waiting on it has its readiness counter decremented.
+
+        expected_step is the position of the step the caller means to finish;
+        if another step is active by now, nothing changes. Marking a done task
+        again is a no-op too. Both still return True.
+        """
+        now = datetime.now().isoformat()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT status FROM tasks WHERE id = ?', (task_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            if row['status'] == 'done':
+                return True
+
+            cursor.execute(
+                '''UPDATE task_steps SET status = "done", completed_at = ?
+                   WHERE task_id = ? AND status = "active"
+                   AND (? IS NULL OR position = ?)''',
+                (now, task_id, expected_step, expected_step)
+            )
+            if cursor.rowcount == 0 and expected_step is not None:
+                return True
             if cursor.rowcount > 0:
-                add_task_history(task_id, 'completed', 'Task marked as done')
+                cursor.execute(
+                    '''SELECT id, description, owner FROM task_steps
+                       WHERE task_id = ? AND status = "pending"
+                       ORDER BY position LIMIT 1''',
+                    (task_id,)
+                )
+                step = cursor.fetchone()
+                if step:
+                    cursor.execute(
+                        'UPDATE task_steps SET status = "active" WHERE id = ?',
+                        (step['id'],)
+                    )
+                    cursor.execute(
+                        'UPDATE tasks SET owner = ?, next_step = ? WHERE id = ?',
+                        (step['owner'], step['description'], task_id)
+                    )
+                    conn.commit()
+
+                    add_task_history(
+                        task_id, 'step_completed',
+                        f'Next step: {step["description"]} ({step["owner"]})'
+                    )
+                    return True
+
+            cursor.execute(
+                'UPDATE tasks SET status = "done", completed_at = ? WHERE id = ? AND status = "open"',
+                (now, task_id)
+            )
+            if cursor.rowcount == 0:
                 return True
-            return False
+
+            cursor.execute(
+                '''UPDATE task_readiness SET pending_deps = pending_deps - 1
+                   WHERE task_id IN (
+                       SELECT task_id FROM task_dependencies WHERE depends_on_id = ?
+                   )''',
+                (task_id,)
+            )
+            conn.commit()
+
+            add_task_history(task_id, 'completed', 'Task marked as done')
+            return True
 
     @staticmethod
     def reassign(task_id: int, new_owner: str) -> bool:
-        """Reassign a task to a new owner."""
+        """Reassign a task (and its active step) to a new owner.
+
+        Reassigning to the current owner is a no-op that still returns True.
+        """
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'UPDATE tasks SET owner = ? WHERE id = ?',
+                'UPDATE tasks SET owner = ? WHERE id = ? AND owner IS NOT ?',
+                (new_owner, task_id, new_owner)
+            )
+            if cursor.rowcount == 0:
+                return _task_exists(cursor, task_id)
+
+            cursor.execute(
+                'UPDATE task_steps SET owner = ? WHERE task_id = ? AND status = "active"',
                 (new_owner, task_id)
             )
             conn.commit()
 
-            if cursor.rowcount > 0:
-                add_task_history(task_id, 'reassigned', f'Reassigned to {new_owner}')
-                return True
-            return False
+            add_task_history(task_id, 'reassigned', f'Reassigned to {new_owner}')
+            return True
 
     @staticmethod
     def update_due_date(task_id: int, new_due_date: str) -> bool:
-        """Update the due date of a task."""
+        """Update the due date of a task, skipping the write if unchanged."""
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'UPDATE tasks SET due_date = ? WHERE id = ?',
-                (new_due_date, task_id)
+                'UPDATE tasks SET due_date = ? WHERE id = ? AND due_date IS NOT ?',
+                (new_due_date, task_id, new_due_date)
             )
+            if cursor.rowcount == 0:
+                return _task_exists(cursor, task_id)
             conn.commit()
 
-            if cursor.rowcount > 0:
-                add_task_history(task_id, 'due_date_changed', f'New due date: {new_due_date}')
-                return True
-            return False
+            add_task_history(task_id, 'due_date_changed', f'New due date: {new_due_date}')
+            return True
 
     @staticmethod
     def update_next_step(task_id: int, next_step: str) -> bool:
-        """Update the next step of a task."""
+        """Update the next step of a task, skipping the write if unchanged."""
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'UPDATE tasks SET next_step = ? WHERE id = ?',
-                (next_step, task_id)
+                'UPDATE tasks SET next_step = ? WHERE id = ? AND next_step IS NOT ?',
+                (next_step, task_id, next_step)
             )
+            if cursor.rowcount == 0:
+                return _task_exists(cursor, task_id)
             conn.commit()
 
-            if cursor.rowcount > 0:
-                add_task_history(task_id, 'next_step_updated', f'Next step: {next_step}')
-                return True
-            return False
+            add_task_history(task_id, 'next_step_updated', f'Next step: {next_step}')
+            return True
 
     def to_dict(self) -> Dict:
         """Convert task to dictionary."""
@@ -205,3 +446,34 @@ class Task:
             'completed_at': self.completed_at,
             'notes': self.notes
         }
+
+
+def _task_exists(cursor, task_id: int) -> bool:
+    """Check whether a task exists (used when a conditional update matched nothing)."""
+    cursor.execute('SELECT 1 FROM tasks WHERE id = ?', (task_id,))
+    return cursor.fetchone() is not None
+
+
+def _normalize_steps(steps: Optional[List], default_owner: str) -> List[Dict]:
+    """Turn step strings/dicts into dicts with 'description' and 'owner'."""
+    normalized = []
+    for step in steps or []:
+        if isinstance(step, str):
+            step = {'description': step}
+        description = (step.get('description') or '').strip()
+        if not description:
+            continue
+        normalized.append({
+            'description': description,
+            'owner': step.get('owner') or _step_owner(description) or default_owner,
+        })
+    return normalized
+
+
+def _step_owner(description: str) -> Optional[str]:
+    """Return the known user a step description starts with, e.g. 'Ofek submits'."""
+    first_word = description.split(' ', 1)[0]
+    for user in Config.USERS:
+        if first_word.lower() == user.lower():
+            return user
+    return None
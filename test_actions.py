@@ -0,0 +1,115 @@
+"""Test idempotent quick action links."""
+import os
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+from config import Config
+from database import init_db, get_db
+from models import Task
+
+
+def history_count(task_id):
+    """Number of history rows recorded for a task."""
+    with get_db() as conn:
+        return conn.execute(
+            'SELECT COUNT(*) FROM task_history WHERE task_id = ?', (task_id,)
+        ).fetchone()[0]
+
+
+def test_quick_actions_are_idempotent():
+    """Replayed links are served from cache and unchanged values skip writes."""
+    print("🧪 Testing quick actions...\n")
+
+    if os.path.exists('test_actions.db'):
+        os.remove('test_actions.db')
+    Config.DATABASE_PATH = 'test_actions.db'
+    init_db()
+
+    from app import create_app, generate_quick_actions
+    client = create_app().test_client()
+
+    task_id = Task.create(title="Pay electricity bill", owner="Ofek", due_date="2024-01-20")
+    actions = generate_quick_actions(task_id)
+
+    def path(url):
+        parts = urlsplit(url)
+        return f'{parts.path}?{parts.query}'
+
+    # First tap applies the action, replays come back from cache
+    response = client.get(path(actions['reassign_wife']))
+    assert response.status_code == 200
+    assert Task.get_by_id(task_id).owner == "Wife"
+    count = history_count(task_id)
+
+    Task.reassign(task_id, "Ofek")
+    replay = client.get(path(actions['reassign_wife']))
+    assert replay.status_code == 200
+    assert replay.get_data() == response.get_data()
+    assert history_count(task_id) == count + 1, "Only the direct reassign is recorded"
+    assert Task.get_by_id(task_id).owner == "Ofek", "Replay must not re-apply the action"
+
+    # The persistent table answers replays after the in-memory cache is lost
+    from actions import _results
+    _results.clear()
+    assert client.get(path(actions['reassign_wife'])).get_data() == response.get_data()
+    assert Task.get_by_id(task_id).owner == "Ofek"
+    print("✅ Replayed link answered from cache")
+
+    # Tampered parameters or signatures are rejected
+    tampered = path(actions['reassign_wife']).replace('to=Wife', 'to=Mallory')
+    assert client.get(tampered).status_code == 403
+    print("✅ Tampered link rejected")
+
+    # Links without a token still work, and unchanged values write nothing
+    count = history_count(task_id)
+    assert Task.reassign(task_id, "Ofek")
+    assert Task.update_due_date(task_id, "2024-01-20")
+    assert Task.update_next_step(task_id, "Call supplier")
+    assert Task.update_next_step(task_id, "Call supplier")
+    assert client.get(f'/markDone/{task_id}').status_code == 200
+    assert client.get(f'/markDone/{task_id}').status_code == 200
+    assert history_count(task_id) == count + 2, "Only real changes are recorded"
+    assert not Task.reassign(9999, "Ofek")
+    print("✅ Unchanged values skip the write path")
+
+    # A mark-done link only ever finishes the step it was issued for
+    stepped_id = Task.create(title="Upload docs", owner="Wife",
+                             steps=["Wife scans", "Ofek submits"])
+    mark_done = path(generate_quick_actions(stepped_id)['mark_done'])
+    assert 'step=0' in mark_done
+    client.get(mark_done)
+    client.get(mark_done)
+    assert [s['status'] for s in Task.get_steps(stepped_id)] == ['done', 'active']
+
+    from actions import _results, reserve_action
+    _results.clear()
+    with get_db() as conn:
+        conn.execute('DELETE FROM action_results')
+        conn.commit()
+    client.get(mark_done)
+    assert [s['status'] for s in Task.get_steps(stepped_id)] == ['done', 'active'], \
+        "An old link must not finish a later step once the cache is gone"
+    print("✅ Mark-done link bound to its step")
+
+    # A token is claimed once, before the action runs
+    assert reserve_action('test-token')
+    assert not reserve_action('test-token')
+
+    # A reservation left behind by a killed request is taken over after its lease
+    leftover_id = Task.create(title="Book dentist", owner="Ofek")
+    reassign = path(generate_quick_actions(leftover_id)['reassign_wife'])
+    token = parse_qs(urlsplit(reassign).query)['token'][0]
+    stale = (datetime.now() - timedelta(seconds=Config.ACTION_LEASE_SECONDS + 1)).isoformat()
+    with get_db() as conn:
+        conn.execute('INSERT INTO action_results (token, created_at) VALUES (?, ?)',
+                     (token, stale))
+        conn.commit()
+    assert client.get(reassign).status_code == 200
+    assert Task.get_by_id(leftover_id).owner == "Wife"
+    print("✅ Leftover reservation taken over")
+
+    os.remove('test_actions.db')
+    print("\n✅ All quick action tests passed!")
+
+
+if __name__ == '__main__':
+    test_quick_actions_are_idempotent()
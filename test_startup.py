@@ -0,0 +1,78 @@
+"""Benchmark cold start: import time and time to first response."""
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Generous budgets: they catch eager work creeping back into import/startup,
+# not small regressions on a slow machine
+IMPORT_BUDGET_SECONDS = 2.0
+FIRST_RESPONSE_BUDGET_SECONDS = 3.0
+
+COLD_START_SCRIPT = '''
+import json, os, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+lazy = {
+    'dateutil_loaded': 'dateutil' in sys.modules,
+    'db_created': os.path.exists(os.environ['DATABASE_PATH']),
+}
+response = app.create_app().test_client().get('/open')
+first_response = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - start,
+    'first_response_seconds': first_response - start,
+    'status_code': response.status_code,
+    **lazy,
+}))
+'''
+
+
+def test_cold_start():
+    """Importing the app does no eager work and the first request is fast."""
+    db_path = 'test_startup.db'
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    result = subprocess.run(
+        [sys.executable, '-c', COLD_START_SCRIPT],
+        env={**os.environ, 'DATABASE_PATH': db_path},
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+
+    print(f"⏱️  Import: {stats['import_seconds'] * 1000:.0f} ms")
+    print(f"⏱️  First response: {stats['first_response_seconds'] * 1000:.0f} ms")
+
+    assert not stats['dateutil_loaded'], "dateutil should be imported lazily"
+    assert not stats['db_created'], "Importing the app should not touch the database"
+    assert stats['status_code'] == 200
+    assert stats['import_seconds'] < IMPORT_BUDGET_SECONDS
+    assert stats['first_response_seconds'] < FIRST_RESPONSE_BUDGET_SECONDS
+
+    os.remove(db_path)
+
+
+def test_templates_preloaded_after_first_response():
+    """Templates are compiled in the background once a response is sent."""
+    from app import create_app
+
+    app = create_app()
+    assert len(app.jinja_env.cache) == 0
+
+    response = app.test_client().get('/health')
+    response.close()
+
+    expected = len(app.jinja_env.list_templates())
+    deadline = time.perf_counter() + 5
+    while len(app.jinja_env.cache) < expected and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert len(app.jinja_env.cache) == expected
+
+
+if __name__ == '__main__':
+    test_cold_start()
+    test_templates_preloaded_after_first_response()
@@ -0,0 +1,141 @@
+"""Test multi-step workflows and task dependencies."""
+import os
+import re
+from database import init_db, get_db
+from models import Task
+
+
+def setup_db(path):
+    """Point the app at a fresh database file."""
+    if os.path.exists(path):
+        os.remove(path)
+
+    from config import Config
+    Config.DATABASE_PATH = path
+    init_db()
+
+
+def test_workflow_steps_and_dependencies():
+    """Test step activation, readiness tracking and cycle detection."""
+    print("🧪 Testing workflows...\n")
+    setup_db('test_workflow.db')
+
+    # Task with ordered steps: completing a step hands over to the next owner
+    docs_id = Task.create(
+        title="Upload medical documents",
+        owner="Wife",
+        steps=[
+            "Scan documents",
+            {"description": "Submit to portal", "owner": "Ofek"},
+        ]
+    )
+    docs = Task.get_by_id(docs_id)
+    assert docs.owner == "Wife"
+    assert docs.next_step == "Scan documents"
+
+    # Task that cannot start before the documents are in
+    claim_id = Task.create(title="Claim refund", owner="Ofek", depends_on=[docs_id])
+    assert [t.id for t in Task.get_ready_by_owner("Ofek")] == []
+    assert [t.id for t in Task.get_blocked_by_owner("Ofek")] == [claim_id]
+    print(f"✅ Task #{claim_id} is blocked by task #{docs_id}")
+
+    Task.mark_done(docs_id)
+    docs = Task.get_by_id(docs_id)
+    assert docs.status == 'open', "Task should stay open until its last step"
+    assert docs.owner == "Ofek", "Next step owner should take over the task"
+    assert docs.next_step == "Submit to portal"
+    assert [s['status'] for s in Task.get_steps(docs_id)] == ['done', 'active']
+    print(f"✅ Step completed, task #{docs_id} reassigned to {docs.owner}")
+
+    Task.mark_done(docs_id)
+    assert Task.get_by_id(docs_id).status == 'done'
+    assert [t.id for t in Task.get_ready_by_owner("Ofek")] == [claim_id]
+    print(f"✅ Task #{claim_id} is ready once task #{docs_id} is done")
+
+    # Marking a done task again must not touch readiness counters
+    Task.mark_done(docs_id)
+    with get_db() as conn:
+        row = conn.execute(
+            'SELECT pending_deps FROM task_readiness WHERE task_id = ?', (claim_id,)
+        ).fetchone()
+    assert row['pending_deps'] == 0
+
+    # Dependencies added later are counted and cycles are rejected
+    review_id = Task.create(title="Review claim", owner="Wife")
+    assert Task.add_dependency(review_id, claim_id)
+    assert [t.id for t in Task.get_blocked_by_owner("Wife")] == [review_id]
+    try:
+        Task.add_dependency(claim_id, review_id)
+        assert False, "Cycle should be rejected"
+    except ValueError:
+        print("✅ Cycle rejected")
+    assert not Task.add_dependency(review_id, 9999)
+
+    try:
+        Task.create(title="Orphan", owner="Ofek", depends_on=[9999])
+        assert False, "Unknown dependency should be rejected"
+    except ValueError:
+        pass
+
+    os.remove('test_workflow.db')
+    print("\n✅ All workflow tests passed!")
+
+
+def test_cycle_detection_on_long_chain():
+    """Cycle check on a long dependency chain stays linear."""
+    setup_db('test_workflow_chain.db')
+
+    ids = [Task.create(title="Chain start", owner="Ofek")]
+    for i in range(1, 500):
+        ids.append(Task.create(title=f"Chain {i}", owner="Ofek", depends_on=[ids[-1]]))
+
+    try:
+        Task.add_dependency(ids[0], ids[-1])
+        assert False, "Closing the chain should be rejected"
+    except ValueError:
+        pass
+    assert Task.add_dependency(ids[-1], ids[0])
+
+    os.remove('test_workflow_chain.db')
+
+
+def test_workflow_api():
+    """API input is validated and step hand-over is reported."""
+    setup_db('test_workflow_api.db')
+
+    from app import create_app
+    client = create_app().test_client()
+
+    for bad in ({'steps': 'abc'}, {'steps': [1]}, {'depends_on': 5}, {'depends_on': ['x']},
+                {'steps': [{'description': 'a', 'owner': ['W']}]},
+                {'depends_on': [2 ** 70]}, {'owner': 5}, {'owner': ''}):
+        response = client.post('/api/newTask', json={'title': 'Bad', 'owner': 'Wife', **bad})
+        assert response.status_code == 400, bad
+
+    response = client.post('/api/newTask', json={
+        'title': 'Upload docs', 'owner': 'Wife', 'steps': ['Wife scans', 'Ofek submits']
+    })
+    task_id = response.get_json()['task_id']
+    assert [s['owner'] for s in Task.get_steps(task_id)] == ['Wife', 'Ofek']
+
+    message = client.post(f'/markDone/{task_id}').get_json()['message']
+    assert 'next: Ofek submits (Ofek)' in message
+    message = client.post(f'/markDone/{task_id}').get_json()['message']
+    assert message == f'Task #{task_id} marked as done'
+
+    # Double-tapping the Mark Done button on /open finishes only one step
+    task_id = Task.create(title='Renew passport', owner='Wife',
+                          steps=['Wife fills form', 'Ofek pays fee', 'Wife books visit'])
+    page = client.get('/open').get_data(as_text=True)
+    button = re.search(rf'href="(/markDone/{task_id}[^"]*)"', page).group(1)
+    client.get(button)
+    client.get(button)
+    assert [s['status'] for s in Task.get_steps(task_id)] == ['done', 'active', 'pending']
+
+    os.remove('test_workflow_api.db')
+
+
+if __name__ == '__main__':
+    test_workflow_steps_and_dependencies()
+    test_cycle_detection_on_long_chain()
+    test_workflow_api()